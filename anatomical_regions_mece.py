@@ -4,6 +4,7 @@ import utils.file_utils as file_utils
 import utils.sdf_utils as sdf_utils
 import utils.views_generator_utils as views_generator
 import utils.tiff_utils as tiff_utils
+import utils.parallel_utils as parallel_utils
 from pathlib import Path
 
 base_directory = Path("/path/to/your/base/regions/directory")
@@ -19,13 +20,15 @@ def start_MECEing_kunst_regions():
     anatomical_structures_txt_path = base_directory / "0_anatomical_structures_list/anatomical_structures_list.txt"
 
     # Step A: Process and save smoothed boundaries (if needed)
-    sdf_utils.process_and_save_smoothed_boundary(leaves_regions_dir, smoothed_leaves_regions_dir, np.uint8)
+    sdf_utils.process_and_save_smoothed_boundary(leaves_regions_dir, smoothed_leaves_regions_dir, np.uint8,
+                                                 max_workers=parallel_utils.VOLUME_MAX_WORKERS)
 
     # Step B: Create a combined 8-bit grayscale TIFF file
     smoothed_leaves_tif_path = base_directory / "2_smoothed_leaves_regions.tif"
     file_utils.remove_file(smoothed_leaves_tif_path)
 
-    tif_paths, colors, _ = file_utils.parse_anatomical_structures_txt_file(
+    # Parsed once: the colors and the regions dictionary are reused in Step F
+    tif_paths, colors, regions_dict = file_utils.parse_anatomical_structures_txt_file(
         anatomical_structures_txt_path, smoothed_leaves_regions_dir
     )
     tiff_utils.merge_8bit_grayscale_tif_files(smoothed_leaves_tif_path, tif_paths, colors)
@@ -53,22 +56,21 @@ def start_MECEing_kunst_regions():
     file_utils.remove_all_files(extracted_regions_dir)
     os.makedirs(extracted_regions_dir, exist_ok=True)
 
-    _, colors, regions_dict = file_utils.parse_anatomical_structures_txt_file(
-        anatomical_structures_txt_path, ""
-    )
     tiff_utils.extract_8bit_grayscale_tif_files(mece_regions_stack_path, colors, regions_dict, extracted_regions_dir)
 
     # Step G: Convert dorsal regions to coronal views
     coronal_regions_dir = base_directory / "6_coronal_regions"
     file_utils.remove_all_files(coronal_regions_dir)
     os.makedirs(coronal_regions_dir, exist_ok=True)
-    views_generator.convert_dorsals_tiffs_to_other_views(extracted_regions_dir, coronal_regions_dir, "coronal")
+    views_generator.convert_dorsals_tiffs_to_other_views(extracted_regions_dir, coronal_regions_dir, "coronal",
+                                                         max_workers=parallel_utils.VOLUME_MAX_WORKERS)
 
     # Step H: Convert dorsal regions to sagittal views
     sagittal_regions_dir = base_directory / "7_sagittal_regions"
     file_utils.remove_all_files(sagittal_regions_dir)
     os.makedirs(sagittal_regions_dir, exist_ok=True)
-    views_generator.convert_dorsals_tiffs_to_other_views(extracted_regions_dir, sagittal_regions_dir, "sagittal")
+    views_generator.convert_dorsals_tiffs_to_other_views(extracted_regions_dir, sagittal_regions_dir, "sagittal",
+                                                         max_workers=parallel_utils.VOLUME_MAX_WORKERS)
 
 
 if __name__ == '__main__':
@@ -29,10 +29,10 @@ def remove_all_files(directory_path):
     - directory_path (str): The path of the directory containing files to be removed.
     """
     if os.path.isdir(directory_path):
-        for filename in os.listdir(directory_path):
-            file_path = os.path.join(directory_path, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
+        with os.scandir(directory_path) as entries:
+            for entry in entries:
+                if entry.is_file():  # File type cached from the directory listing, no extra stat call
+                    os.remove(entry.path)
 
 
 def parse_anatomical_structures_txt_file(txt_file_path, regions_path):
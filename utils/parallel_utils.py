@@ -0,0 +1,50 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Default number of worker processes for jobs on whole 3D volumes: each worker holds a full volume and its
+# distance transforms in memory, so only a few run at once
+VOLUME_MAX_WORKERS = 2
+
+
+def default_max_workers():
+    """
+    Return the default number of worker processes: 70% of the CPU cores, at least one.
+    """
+    return max(1, int(0.7 * (os.cpu_count() or 1)))
+
+
+def run_in_processes(function, args_list, max_workers=None):
+    """
+    Call a function once per arguments tuple using a pool of worker processes.
+
+    Parameters:
+    - function (callable): Module-level function to call (it must be picklable).
+    - args_list (list of tuple): Positional arguments of each call.
+    - max_workers (int): Number of worker processes; defaults to default_max_workers(). With 1 the calls run in this process.
+
+    Returns:
+    - list: Results of the calls, in the same order as args_list.
+    """
+    max_workers = max_workers or default_max_workers()
+    if max_workers == 1:
+        return [function(*args) for args in args_list]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(function, *args) for args in args_list]
+        return [future.result() for future in futures]
+
+
+def run_in_threads(function, args_list, max_workers=8):
+    """
+    Call a function once per arguments tuple using a pool of threads, suited to I/O bound work such as reading TIFF files.
+
+    Parameters:
+    - function (callable): Function to call.
+    - args_list (list of tuple): Positional arguments of each call.
+    - max_workers (int): Number of threads.
+
+    Returns:
+    - list: Results of the calls, in the same order as args_list.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(function, *args) for args in args_list]
+        return [future.result() for future in futures]
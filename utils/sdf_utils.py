@@ -6,6 +6,43 @@ from skimage import io
 from scipy.ndimage import distance_transform_edt
 import utils.tiff_utils as tiff_utils
 import utils.file_utils as file_utils
+import utils.parallel_utils as parallel_utils
+
+try:  # Optional GPU backend: cuCIM's distance transform on CuPy arrays
+    import cupy as cp
+    from cucim.core.operations.morphology import distance_transform_edt as cu_distance_transform_edt
+    GPU_AVAILABLE = cp.cuda.is_available()
+except Exception:  # Not installed, or unusable (e.g. CUDA driver/runtime mismatch raising RuntimeError): fall back to SciPy
+    cp = None
+    GPU_AVAILABLE = False
+
+# Spacing between stacked 2D slices, large enough that gaps are never filled across slices
+SLICE_SAMPLING = 1e6
+
+# Number of voxels stacked into one gap-filling chunk. Filling peaks at about 50 bytes per voxel
+# (int32 indices, float64 distances and SciPy temporaries), so a chunk needs about 200 MB per worker
+CHUNK_VOXELS = 4 * 1024 ** 2
+
+
+def gaussian_kernel1d(sigma, truncate=4.0):
+    """
+    Compute the normalized 1D Gaussian kernel used by ndimage.gaussian_filter for the same sigma and truncate.
+
+    Parameters:
+    - sigma (float): Standard deviation of the Gaussian.
+    - truncate (float): Truncate the kernel at this many standard deviations.
+
+    Returns:
+    - np.ndarray: Kernel taps of length 2 * int(truncate * sigma + 0.5) + 1.
+    """
+    radius = int(truncate * sigma + 0.5)
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 / sigma ** 2 * x ** 2)
+    return kernel / kernel.sum()
+
+
+# Gaussian kernel smoothing the SDF, computed once at module load
+SMOOTHING_KERNEL = gaussian_kernel1d(sigma=2.0)
 
 
 def create_smoothed_boundary(mask_data: np.ndarray, threshold: int = 0) -> np.ndarray:
@@ -19,45 +56,137 @@ def create_smoothed_boundary(mask_data: np.ndarray, threshold: int = 0) -> np.nd
     Returns:
     - np.ndarray: Smoothed binary mask.
     """
-    binary_mask = (mask_data > 0).astype(np.uint8)  # Convert mask to binary (0s and 1s)
-    sdf_inside = ndimage.distance_transform_edt(binary_mask)  # Compute distance transform for the inside
-    sdf_outside = ndimage.distance_transform_edt(1 - binary_mask)  # Compute distance transform for the outside
-    sdf = sdf_inside - sdf_outside  # Calculate Signed Distance Function (SDF)
-    smoothed_sdf = ndimage.gaussian_filter(sdf, sigma=2.0)  # Smooth the SDF with a Gaussian filter
-    smoothed_mask = (smoothed_sdf > threshold).astype(np.uint8) * 255  # Create a binary mask from the smoothed SDF
+    binary_mask = mask_data > 0  # Convert mask to binary (boolean, no uint8 copy)
+    # The distances are kept in float32, enough precision for an 8-bit boundary and half the memory traffic of float64
+    sdf_inside = ndimage.distance_transform_edt(binary_mask).astype(np.float32)  # Compute distance transform for the inside
+    sdf_outside = ndimage.distance_transform_edt(~binary_mask).astype(np.float32)  # Compute distance transform for the outside
+    sdf = sdf_inside  # Calculate Signed Distance Function (SDF) in place
+    sdf -= sdf_outside
+    del sdf_outside
+    for axis in range(sdf.ndim):  # Smooth the SDF in place with a separable Gaussian filter (sigma=2.0), one 1D pass per axis
+        ndimage.correlate1d(sdf, SMOOTHING_KERNEL, axis=axis, output=sdf)
+    smoothed_mask = (sdf > threshold).astype(np.uint8) * 255  # Create a binary mask from the smoothed SDF
     return smoothed_mask  # Return the smoothed binary mask
 
 
-def process_and_save_smoothed_boundary(input_directory, output_directory, dtype):
+def save_smoothed_boundary(tif_path, output_tif_path, dtype):
+    """
+    Create the smoothed boundary of a single TIFF file and save it.
+
+    Parameters:
+    - tif_path (str): Path of the input TIFF file.
+    - output_tif_path (str): Path to save the smoothed TIFF file.
+    - dtype (np.dtype): Data type for the loaded TIFF image.
+    """
+    print(f"save_smoothed_boundary() ==> Start smoothing ==> {os.path.basename(tif_path)}")  # Log the processing start
+    tif_data = tiff_utils.load_tiff_image(tif_path, dtype)  # Load the TIFF data
+    smoothed_tif = create_smoothed_boundary(tif_data, threshold=0)  # Create smoothed boundary
+    tiff_utils.save_tif_file(output_tif_path, smoothed_tif)  # Save the smoothed boundary
+    del tif_data, smoothed_tif  # Delete variables to free memory
+    gc.collect()  # Force garbage collection
+
+
+def process_and_save_smoothed_boundary(input_directory, output_directory, dtype,
+                                       max_workers=parallel_utils.VOLUME_MAX_WORKERS):
     """
     Process all TIFF files in the input directory, create smoothed boundaries, and save them.
+    The files are processed in parallel worker processes.
 
     Parameters:
     - input_directory (str): Directory containing input TIFF files.
     - output_directory (str): Directory to save the processed output files.
     - dtype (np.dtype): Data type for the loaded TIFF images.
+    - max_workers (int): Number of worker processes. Each one smooths a whole volume (about 20 bytes per voxel),
+      so keep it low enough for the available memory.
     """
     file_utils.remove_all_files(output_directory)
-    for tif_region in os.listdir(input_directory):  # Iterate through files in the input directory
+    smoothing_jobs = []
+    with os.scandir(input_directory) as entries:
+        tif_regions = [entry.name for entry in entries if entry.is_file()]
+    for tif_region in tif_regions:  # Iterate through files in the input directory
         output_tif_path = os.path.join(output_directory, tif_region)  # Construct output file path
         if not os.path.isfile(output_tif_path):  # Check if the output file already exists
-            print(
-                f"process_and_save_smoothed_boundary() ==> Start smoothing ==> {tif_region}")  # Log the processing start
             tif_path = os.path.join(input_directory, tif_region)  # Construct input file path
             if tif_path.endswith(".tif"):  # Check if the file is a TIFF
-                tif_data = tiff_utils.load_tiff_image(tif_path, dtype)  # Load the TIFF data
-                smoothed_tif = create_smoothed_boundary(tif_data, threshold=0)  # Create smoothed boundary
-                tiff_utils.save_tif_file(output_tif_path, smoothed_tif)  # Save the smoothed boundary
-                del tif_data, smoothed_tif  # Delete variables to free memory
-                gc.collect()  # Force garbage collection
+                smoothing_jobs.append((tif_path, output_tif_path, dtype))
+    parallel_utils.run_in_processes(save_smoothed_boundary, smoothing_jobs, max_workers)
+
+
+def regions_bounding_box(regions, max_distance, sampling=None):
+    """
+    Compute the bounding box of the region pixels, grown by max_distance along each axis and clipped to the image.
+
+    Parameters:
+    - regions: np.ndarray, boolean mask of the region pixels (at least one pixel set).
+    - max_distance: float, distance to grow the bounding box by.
+    - sampling: sequence of float, spacing of the image along each axis (None means 1 for every axis).
+
+    Returns:
+    - tuple of slice: The grown bounding box, to index the image with.
+    """
+    if sampling is None:
+        sampling = (1,) * regions.ndim
+    box = []
+    for axis, spacing in enumerate(sampling):
+        other_axes = tuple(other_axis for other_axis in range(regions.ndim) if other_axis != axis)
+        positions = regions.any(axis=other_axes).nonzero()[0]  # Positions along this axis holding region pixels
+        margin = int(np.ceil(max_distance / spacing))
+        box.append(slice(max(int(positions[0]) - margin, 0), int(positions[-1]) + margin + 1))
+    return tuple(box)
+
+
+def fill_image_gaps(image, max_distance, sampling=None):
+    """
+    Fill the background (0) pixels of an image with the gray value of the closest region within max_distance.
+    Runs on the GPU with cuCIM when it is installed and a CUDA device is available, otherwise on the CPU with SciPy.
+
+    Parameters:
+    - image: np.ndarray, grayscale image where 0 is background and every other value is a region.
+    - max_distance: float, maximum distance to fill gaps.
+    - sampling: sequence of float, spacing of the image along each axis (None means 1 for every axis).
+      A stack of 2D slices uses (SLICE_SAMPLING, 1, 1) so that each slice is filled independently.
+
+    Returns:
+    - filled_image: np.ndarray, the image with gaps filled up to the specified distance.
+    """
+    xp, edt_function = (cp, cu_distance_transform_edt) if GPU_AVAILABLE else (np, distance_transform_edt)
+    image = xp.asarray(image)  # Upload to the GPU when running with cuCIM
+
+    # Initialize the filled image as a copy of the original
+    filled_image = image.copy()
+
+    # Background pixels (0) are the gaps candidates; every other gray value belongs to a region
+    background = image == 0
+
+    # The distance transform is meaningless without any region (or without any gap), so there is nothing to fill
+    if background.any() and not background.all():
+        # Pixels farther than max_distance from the regions bounding box can't be filled, so the transform is restricted to
+        # that box grown by max_distance. The box holds every region pixel, so the closest region of each pixel in it is unchanged.
+        box = regions_bounding_box(~background, max_distance, sampling)
+        background = background[box]
+
+        # Compute the distance transform of the background. Every background pixel gets its distance to the closest region pixel (any color),
+        # and return_indices gives the coordinates of that closest region pixel. e.g: image=[[0, 0, 5, 0, 7]] ==> dt=[[2, 1, 0, 1, 0]], indices=[[[0, 0, 0, 0, 0]], [[2, 2, 2, 2, 4]]]
+        # This replaces one distance transform per color with a single one for the whole image.
+        dt, indices = edt_function(background, sampling=sampling, return_distances=True,
+                                   return_indices=True)
+
+        # Fill gaps where the original image is background (0) and within max distance
+        fill_condition = dt <= max_distance
+        fill_condition &= background
+
+        # Set the gray value of the closest region, gathered for the gap pixels only (no full size image of nearest values)
+        filled_image[box][fill_condition] = image[box][tuple(index[fill_condition] for index in indices)]
+
+    return cp.asnumpy(filled_image) if xp is cp else filled_image
 
 
 def fill_2d_image_gaps(image_path, max_distance, output_path):
     """
     Fill gaps between 2D image regions in different gray colors using a signed distance function.
-    The algorithm works by computing the Euclidean distance transform for each region in the image.
-    It uses these distances to determine the nearest region for each pixel up to a specified maximum distance.
-    The gaps within this distance are then filled with the grayscale value of the closest region,
+    The algorithm works by computing a single Euclidean distance transform of the image background.
+    Together with the distances, the transform returns for each background pixel the coordinates of the nearest region pixel.
+    The gaps within the specified maximum distance are then filled with the grayscale value of that closest region,
     effectively filling the gaps between regions.
     This process ensures smooth transitions and fills in missing areas in the image based on proximity to existing regions.
 
@@ -75,48 +204,53 @@ def fill_2d_image_gaps(image_path, max_distance, output_path):
     if image is None:
         raise FileNotFoundError(f"Image not found at {image_path}")
 
-    # Initialize the filled image as a copy of the original
-    filled_image = image.copy()
-
-    # Identify unique grayscale values (regions), it will return an array of the colors I have in the image. e.g:[0 103 105 107 109 126 136 138 139 144 145 146 159 161 162 168 169]
-    unique_colors = np.unique(image)
-
-    # Creates a new array with the same shape of image and fills it with the value np.inf (infinity), to store the minimum distance to a region for each pixel in the image.
-    # All distances are set to infinity because I haven't computed any distances yet. As the algorithm processes each region, it will update this array with the actual minimum distances.
-    min_distances = np.full(image.shape, np.inf)
+    filled_image = fill_image_gaps(image, max_distance)
 
-    # Create an array to hold the closest region's value
-    closest_values = np.zeros(image.shape, dtype=image.dtype)
-
-    # Loop over the unique_values grayscale colors we have.e.g.[0 103 105 107 109 126 136 138 139 144 145 146 159 161 162 168 169]
-    for color_value in unique_colors:
-        if color_value == 0:
-            continue  # Skip background
+    # Save the filled image
+    io.imsave(output_path, filled_image)
 
-        # Create a binary mask for the current region. e.g: if the color is (1) and the image=[1,1,0,0,3,4,5], the mask will be[1,1,0,0,0,0]
-        mask = (image == color_value).astype(np.uint8)
 
-        # Compute the distance transform for the current region. The distance transform (Euclidean distance transform) replaces each pixel of a binary image with the distance to the closest background pixel. If the pixel itself is already part of the background then this is 0.
-        # e.g:mask = np.array([[0, 0, 0, 0, 0, 0],[0, 1, 1, 0, 0, 0]], dtype=np.uint8)
-        # inverted_mask = np.array([[1, 1, 1, 1, 1, 1],[1, 0, 0, 1, 1, 1]], dtype=np.uint8), this is the result of:inverted_mask = 1 - mask
-        # The distance_transform_edt function calculates the Euclidean distance transform of the binary image. This means it computes the distance of each pixel to the nearest zero (Current region after inverting).e.g:[1.0, 1.0, 1.0, 1.41421356, 2.0, 2.23606798],[0, 0, 0, 1.0, 2.0, 2.23606798]
-        dt = distance_transform_edt(1 - mask)
+def fill_gaps_in_tif_images(sequences_path, images_names, max_distance, output_path):
+    """
+    Fill gaps in a group of 2D TIFF images stacked together, and save them under the same names in output_path.
 
-        # Update minimum distances and closest values
-        mask_update = (dt < min_distances) & (dt <= max_distance)
-        min_distances[mask_update] = dt[mask_update]
-        closest_values[mask_update] = color_value
+    Parameters:
+    - sequences_path (str): Directory containing the 2D TIFF images.
+    - images_names (list of str): File names of the images to process, all with the same shape.
+    - max_distance (float): Maximum distance to fill gaps.
+    - output_path (str): Directory to save the filled images.
+    """
+    print(f"fill_gaps_in_tif_images() ==> Start processing {len(images_names)} 2d tif images "
+          f"==> {images_names[0]} ... {images_names[-1]}")
+    images = np.stack([tiff_utils.load_image(f"{sequences_path}/{img}") for img in images_names])
+    filled_images = fill_image_gaps(images, max_distance, sampling=(SLICE_SAMPLING, 1, 1))
+    for img, filled_image in zip(images_names, filled_images):
+        io.imsave(f"{output_path}/{img}", filled_image)
 
-    # Fill gaps where the original image is background (0) and within max distance
-    fill_condition = (image == 0) & (min_distances <= max_distance)
-    filled_image[fill_condition] = closest_values[fill_condition]
 
-    # Save the filled image
-    io.imsave(output_path, filled_image)
+def fill_gaps_in_tif_sequence(sequences_path, max_distance, output_path, chunk_voxels=CHUNK_VOXELS, max_workers=None):
+    """
+    Fill gaps in every 2D TIFF image of a sequence directory and save them under the same names in output_path.
+    The images are stacked in chunks of at most chunk_voxels voxels (at least one slice), so one distance transform
+    handles a whole chunk; the slices stay independent thanks to the large sampling along the stacking axis.
+    Chunks are processed in parallel worker processes on the CPU, and one after the other on the GPU.
 
+    Parameters:
+    - sequences_path (str): Directory containing the 2D TIFF image sequence.
+    - max_distance (float): Maximum distance to fill gaps.
+    - output_path (str): Directory to save the filled images.
+    - chunk_voxels (int): Voxel budget of a chunk. Filling peaks at about 50 bytes per voxel, so each worker
+      needs about 50 * chunk_voxels bytes.
+    - max_workers (int): Number of worker processes; defaults to 70% of the CPU cores.
+    """
+    with os.scandir(sequences_path) as entries:
+        images_names = [entry.name for entry in entries if entry.name.endswith(".tif") and entry.is_file()]
+    if not images_names:
+        return
 
-def fill_gaps_in_tif_sequence(sequences_path, max_distance, output_path):
-    for img in os.listdir(sequences_path):
-        if img.endswith(".tif"):
-            print(f"fill_gaps_in_tif_sequence() ==> Start processing 2d tif image named ==> {img}")
-            fill_2d_image_gaps(f"{sequences_path}/{img}", max_distance, f"{output_path}/{img}")
+    # Number of slices per chunk from the voxel budget (all the images of a sequence have the same shape)
+    slice_voxels = tiff_utils.load_image(f"{sequences_path}/{images_names[0]}").size
+    chunk_size = max(1, chunk_voxels // slice_voxels)
+    chunks_jobs = [(sequences_path, images_names[start:start + chunk_size], max_distance, output_path)
+                   for start in range(0, len(images_names), chunk_size)]
+    parallel_utils.run_in_processes(fill_gaps_in_tif_images, chunks_jobs, 1 if GPU_AVAILABLE else max_workers)
@@ -1,9 +1,17 @@
 import os
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from skimage import io
 import tifffile as tiff
-from PIL import Image
+import utils.parallel_utils as parallel_utils
+
+# Pattern of the first number in a file name, compiled once for the numerical sorting of image sequences
+NUMBER_PATTERN = re.compile(r'(\d+)')
+
+# Lossless compression of the saved TIFF files: sparse 8-bit label masks shrink a lot with deflate and horizontal differencing
+TIFF_COMPRESSION = {'compression': 'zlib', 'predictor': True, 'tile': (256, 256)}
 
 
 def load_tiff_image(datapath, dtype):
@@ -52,23 +60,49 @@ def save_tif_file(output_path, tif_data):
     - output_path (str): Path where the TIFF file will be saved.
     - tif_data (np.ndarray): Data to be saved in the TIFF file.
     """
-    with tiff.TiffWriter(output_path) as tif:  # Open a TIFF writer for the output path
-        tif.write(tif_data)  # Write the data to the TIFF file
+    with tiff.TiffWriter(output_path, bigtiff=True) as tif:  # Open a TIFF writer for the output path
+        tif.write(tif_data, **TIFF_COMPRESSION)  # Write the compressed data to the TIFF file
 
 
-def save_tiff_stack_as_tif_image_sequences(tif_path, output_path):
+def save_tiff_stack_as_tif_image_sequences(tif_path, output_path, max_workers=8):
     """
     Save each page of a multi-page TIFF file as separate TIFF images.
+    Pages are decoded one after the other while the individual TIFF files are written by a pool of threads.
 
     Parameters:
     - tif_path (str): Path to the multi-page TIFF file.
     - output_path (str): Directory to save individual TIFF images.
+    - max_workers (int): Number of writing threads.
     """
-    with tiff.TiffFile(tif_path) as tif:
+    with tiff.TiffFile(tif_path) as tif, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending_writes = deque()
         for i, page in enumerate(tif.pages):  # Iterate through each page in the TIFF file
             image = page.asarray()  # Convert the page to a NumPy array
             output_img_path = f'{output_path}/{i}.tif'  # Create output path for the individual TIFF
-            tiff.imwrite(output_img_path, image)  # Save the individual page as a TIFF file
+            pending_writes.append(executor.submit(tiff.imwrite, output_img_path, image,
+                                                  **TIFF_COMPRESSION))  # Save the individual page as a TIFF file
+            # Bound the number of decoded pages waiting to be written, so the whole stack is never held in memory
+            if len(pending_writes) >= 2 * max_workers:
+                pending_writes.popleft().result()
+        for write in pending_writes:
+            write.result()
+
+
+def numerical_sort_key(filename):
+    """
+    Sort key of an image sequence file name, such as "12.tif", by its number.
+
+    Parameters:
+    - filename (str): File name.
+
+    Returns:
+    - int or float: The number in the file name, or inf when it has none.
+    """
+    stem = filename.split('.', 1)[0]
+    if stem.isdecimal():  # Sequences are named "{i}.tif", no regex needed
+        return int(stem)
+    match = NUMBER_PATTERN.search(filename)  # Extract numbers from the filename
+    return int(match.group(0)) if match else float('inf')
 
 
 def save_tif_sequences_to_tiff_stack(input_path, output_tiff):
@@ -77,27 +111,28 @@ def save_tif_sequences_to_tiff_stack(input_path, output_tiff):
     input_directory: Should contain a sequence of images named numerically, such as "1.tif, 2.tif, 3.tif, ...".
     """
 
-    # Function to extract numbers from filenames for proper numerical sorting
-    def numerical_sort(filename):
-        # Extract numbers from the filename
-        match = re.search(r'(\d+)', filename)
-        return int(match.group(0)) if match else float('inf')
-
     # List and sort TIFF files numerically
-    tiff_images = sorted([f for f in os.listdir(input_path) if f.lower().endswith('.tif')],
-                         key=numerical_sort)
+    with os.scandir(input_path) as entries:
+        tiff_images = [entry.name for entry in entries if entry.name.lower().endswith('.tif')]
+    tiff_images.sort(key=numerical_sort_key)
 
-    # Load images into a list
-    images = []
-    for file in tiff_images:
-        img_path = os.path.join(input_path, file)
-        with Image.open(img_path) as img:
-            images.append(np.array(img))  # Convert to NumPy array
+    # Read the first image to size the stack
+    first_image = tiff.imread(os.path.join(input_path, tiff_images[0]))
 
-    # Convert list of images to a 3D NumPy array
-    image_stack = np.stack(images)
+    # Create the output TIFF stack as a memory-mapped file, so the images are decoded straight into it (no in-memory copy of the whole stack).
+    # A memory-mapped TIFF must stay uncompressed, so TIFF_COMPRESSION is not used here.
+    image_stack = tiff.memmap(output_tiff, shape=(len(tiff_images),) + first_image.shape, dtype=first_image.dtype,
+                              photometric='minisblack')
+    image_stack[0] = first_image
 
-    tiff.imwrite(output_tiff, image_stack, photometric='minisblack')
+    # Function to read one image straight into its slice of the stack
+    def read_image_into_stack(index, file):
+        tiff.imread(os.path.join(input_path, file), out=image_stack[index])
+
+    # Read the other images in parallel threads
+    parallel_utils.run_in_threads(read_image_into_stack, list(enumerate(tiff_images))[1:])
+
+    image_stack.flush()  # Write the memory-mapped stack to disk
 
     print(f'convert_tif_sequences_to_tiff_stack() ==> Successfully saved TIFF stack to {output_tiff}')
 
@@ -127,10 +162,11 @@ def merge_8bit_grayscale_tif_files(output_path, tiffs_path, color_values=None):
             print(
                 f"merge_8bit_grayscale_tif_files() ==> Start merging ==> {os.path.basename(region_path)}")  # Log the merging process
             mask_data = tiff.imread(region_path)  # Read the mask data from the TIFF file
-            #  stack and merge binary masks from the TIFF images into a single output image, and set the corresponding color pixels
-            tiff_stack_data[mask_data != 0] = color_value if color_value is not None else 255
+            #  stack and merge binary masks from the TIFF images into a single output image, and set the corresponding color pixels.
+            #  putmask writes the color in place in a single pass (nonzero mask pixels); later files overwrite earlier ones
+            np.putmask(tiff_stack_data, mask_data, tiff_stack_data.dtype.type(color_value if color_value is not None else 255))
 
-    tiff.imwrite(output_path, tiff_stack_data)  # Save the merged data as a new TIFF file
+    tiff.imwrite(output_path, tiff_stack_data, bigtiff=True, **TIFF_COMPRESSION)  # Save the merged data as a new TIFF file
 
 
 def extract_8bit_grayscale_tif_files(combined_tiff, colors, color_to_region_dic, output_path):
@@ -154,12 +190,15 @@ def extract_8bit_grayscale_tif_files(combined_tiff, colors, color_to_region_dic,
         print(f"Error reading the TIFF file: {e}")
         return
 
+    #  Allocate the color match and the binary mask once with the same dimensions as the combined image, they are overwritten for each color
+    color_match = np.empty(combined_image.shape, dtype=np.bool_)
+    binary_mask = np.empty(combined_image.shape, dtype=np.uint8)
+
     # Iterate through the provided color values
     for color_value in colors:
-        #  Initialize a binary mask with the same dimensions as the combined image
-        binary_mask = np.zeros_like(combined_image, dtype=np.uint8)
-        # Set pixels in the mask to 255 where the color value matches
-        binary_mask[combined_image == color_value] = 255
+        # Set pixels in the mask to 255 where the color value matches, and 0 elsewhere
+        np.equal(combined_image, color_value, out=color_match)
+        np.multiply(color_match, np.uint8(255), out=binary_mask)
         # Construct the file path for saving the binary mask
         region_name = color_to_region_dic[color_value]
         tif_file_path = f"{output_path}/{region_name}"
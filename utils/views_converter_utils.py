@@ -3,17 +3,9 @@ import utils.tiff_utils as tiff_utils
 
 
 def transpose_tif(tif_data, tiff_type):
-    # Initialize an array to store the transposed slices. Original access pattern is (z, y, x), but we are using (z, x, y) instead.
-    transposed_slices = np.zeros((tif_data.shape[0], tif_data.shape[2], tif_data.shape[1]), dtype=tiff_type)
-
-    # Transpose each slice of the 3D array
-    for i in range(tif_data.shape[0]):
-        transposed_slices[i] = tif_data[i].transpose()
-
-    # Convert to a supported bit depth (8-bit integers)
-    transposed_slices = transposed_slices.astype(tiff_type)
-
-    return transposed_slices
+    # Transpose each slice of the 3D array in a single contiguous copy. Original access pattern is (z, y, x), but we are using (z, x, y) instead.
+    # Convert to a supported bit depth (8-bit integers), without another copy when it already is
+    return np.ascontiguousarray(tif_data.transpose(0, 2, 1)).astype(tiff_type, copy=False)
 
 
 def convert_dorsal_tif_to_coronal_tif(tif_file_path, output_tif_path):
@@ -24,7 +16,7 @@ def convert_dorsal_tif_to_coronal_tif(tif_file_path, output_tif_path):
 
 def convert_dorsal_tif_to_sagittal_tif(tif_file_path, output_tif_path):
     tif_file_data = tiff_utils.load_tiff_image(tif_file_path, np.uint8)
-    # Rotate the entire 3D array to change from dorsal to sagittal view
+    # Rotate the entire 3D array to change from dorsal to sagittal view (a view, the only copy is made by transpose_tif)
     sagittal_tif_data = np.rot90(tif_file_data, k=3, axes=(0, 2))
     tiff_utils.save_tif_file(output_tif_path, transpose_tif(sagittal_tif_data, np.uint8))
 
@@ -38,7 +30,7 @@ def convert_sagittal_tif_to_coronal_tif(tif_file_path, output_tif_path):
 
 def convert_sagittal_tif_to_dorsal_tif(tif_file_path, output_tif_path):
     tif_file_data = tiff_utils.load_tiff_image(tif_file_path, np.uint8)
-    # Rotate the entire 3D array to change from dorsal to sagittal view
+    # Rotate the entire 3D array to change from sagittal to dorsal view (a view, the only copy is made by transpose_tif)
     dorsal_tif_data = np.rot90(tif_file_data, k=1, axes=(0, 1))
     tiff_utils.save_tif_file(output_tif_path, transpose_tif(dorsal_tif_data, np.uint8))
 
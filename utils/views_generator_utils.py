@@ -1,15 +1,19 @@
 import os
 import utils.views_converter_utils as views_converter
+import utils.parallel_utils as parallel_utils
 
 
-def convert_dorsals_tiffs_to_other_views(regions_dir, target_dir, view_type):
+def convert_dorsals_tiffs_to_other_views(regions_dir, target_dir, view_type,
+                                         max_workers=parallel_utils.VOLUME_MAX_WORKERS):
     """
     Convert dorsal TIFF images to specified views (coronal or sagittal) and save the output.
+    The files are converted in parallel worker processes.
 
     Parameters:
     - regions_dir (str): Directory containing the original dorsal TIFF images.
     - target_dir (str): Directory to save the converted TIFF images.
     - view_type (str): The type of view to convert to, either 'coronal' or 'sagittal'.
+    - max_workers (int): Number of worker processes. Each one converts a whole volume, so keep it low enough for the available memory.
     """
     # Mapping of view types to corresponding TifOrientationConverter methods
     conversion_methods = {
@@ -23,6 +27,7 @@ def convert_dorsals_tiffs_to_other_views(regions_dir, target_dir, view_type):
             f"convert_dorsals_tiffs_to_other_views() ==> Invalid view_type '{view_type}'. Expected 'coronal' or 'sagittal'.")
 
     # Iterate through the files in the regions_dir
+    conversion_jobs = []
     for region in os.listdir(regions_dir):
         if region.lower().endswith(".tif"):  # Check if the file is a TIFF
             region_name, _ = os.path.splitext(region)
@@ -31,5 +36,7 @@ def convert_dorsals_tiffs_to_other_views(regions_dir, target_dir, view_type):
             # Only process if the output file doesn't already exist
             if not os.path.isfile(output_tif_path):
                 tif_dorsal_path = os.path.join(regions_dir, region)
-                # Call the appropriate conversion method
-                conversion_methods[view_type](tif_dorsal_path, output_tif_path)
+                conversion_jobs.append((tif_dorsal_path, output_tif_path))
+
+    # Call the appropriate conversion method for every file in worker processes
+    parallel_utils.run_in_processes(conversion_methods[view_type], conversion_jobs, max_workers)